@@ -3,6 +3,7 @@ FastAPI server for SCRA military active duty verification
 Updated: Testing Railway deployment with Project Token
 """
 
+import logging
 import os
 from datetime import datetime
 from typing import Optional
@@ -17,6 +18,10 @@ from puppeteer_agent import PuppeteerSCRAAgent
 from csv_processor import CSVProcessor
 
 
+# Surface module logs (puppeteer_agent etc.) under uvicorn, which only
+# configures its own loggers
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+
 # Initialize FastAPI app
 app = FastAPI(
     title="SCRA Military Verification API",
@@ -46,6 +51,12 @@ app.add_middleware(
 # Initialize Supabase service
 supabase_service = get_supabase_service()
 
+
+@app.on_event("startup")
+async def warm_supabase_connection():
+    """Open the pooled Supabase connection before the first user request."""
+    await supabase_service.warmup()
+
 # Pydantic models
 class PersonData(BaseModel):
     firstName: str
@@ -85,7 +96,7 @@ async def health_check():
     try:
         svc = get_supabase_service()
         storage_ok = svc.test_storage_connection()
-        tables = svc.check_required_tables()
+        tables = await svc.check_required_tables()
         all_tables_ok = all(tables.values()) if tables else False
 
         status = "healthy" if (storage_ok and all_tables_ok) else ("partial" if storage_ok or all_tables_ok else "error")
@@ -13,20 +13,19 @@ def main():
 
     client = create_client(url, key)
 
-    # 1) Ensure bucket exists
+    # 1) Ensure bucket exists (metadata lookup, no object enumeration)
     try:
-        client.storage.from_(BUCKET_NAME).list("", {"limit": 1})
+        client.storage.get_bucket(BUCKET_NAME)
         print(f"Bucket '{BUCKET_NAME}' already exists and is accessible")
     except Exception as e:
         print(f"Bucket '{BUCKET_NAME}' not accessible: {e}. Creating...")
         try:
+            # create_bucket raises on failure, so no validation call is needed
             client.storage.create_bucket(BUCKET_NAME, {
                 "public": False,
                 "allowedMimeTypes": ["image/png", "image/jpeg", "application/pdf"],
                 "fileSizeLimit": 10485760,
             })
-            # Validate
-            client.storage.from_(BUCKET_NAME).list("", {"limit": 1})
             print(f"Created bucket '{BUCKET_NAME}' successfully")
         except Exception as ce:
             print(f"ERROR: Failed to create bucket '{BUCKET_NAME}': {ce}", file=sys.stderr)
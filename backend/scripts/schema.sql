@@ -50,6 +50,25 @@ create table if not exists public.verification_screenshots (
 
 create index if not exists verification_screenshots_session_id_idx on public.verification_screenshots (session_id);
 
+-- Keep updated_at fresh server-side so clients never send timestamps
+create or replace function public.set_updated_at()
+returns trigger as $$
+begin
+  new.updated_at = now();
+  return new;
+end;
+$$ language plpgsql;
+
+drop trigger if exists verification_sessions_set_updated_at on public.verification_sessions;
+create trigger verification_sessions_set_updated_at
+  before update on public.verification_sessions
+  for each row execute function public.set_updated_at();
+
+drop trigger if exists user_settings_set_updated_at on public.user_settings;
+create trigger user_settings_set_updated_at
+  before update on public.user_settings
+  for each row execute function public.set_updated_at();
+
 -- ============================================================================
 -- STORAGE POLICIES for verification-files bucket
 -- ============================================================================
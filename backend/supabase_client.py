@@ -2,13 +2,42 @@
 Supabase client configuration for the SCRA verification backend
 """
 
+import asyncio
+import atexit
+import functools
+import json
 import os
-from typing import Optional, Dict, Any, List
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, AsyncIterable, List, Union
 from supabase import create_client, Client
 from datetime import datetime
 from dotenv import load_dotenv
 import httpx
 
+# Optional: pyoxipng recompresses headless-browser PNGs 30-60% smaller
+# before upload. Everything works without it; we just upload bigger files.
+try:
+    import oxipng
+except ImportError:
+    oxipng = None
+
+# Optional: orjson serializes the larger verification payloads several
+# times faster than the stdlib; we fall back to json when it's missing
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def _json_content(payload: Any) -> bytes:
+    """Serialize a request body to JSON bytes, preferring orjson."""
+    # Both paths stringify unknown types so serialization behavior doesn't
+    # depend on whether the optional extra is installed
+    if orjson is not None:
+        return orjson.dumps(payload, default=str)
+    return json.dumps(payload, separators=(",", ":"), default=str).encode("utf-8")
+
 # Load environment variables
 load_dotenv()
 
@@ -28,33 +57,98 @@ class SupabaseService:
         # Create client with service role key (full access)
         self.client: Client = create_client(self.url, self.service_key)
         self._url = self.url
+
+        # Pre-built SDK handles: table()/storage.from_() allocate a fresh
+        # wrapper object on every call, so build the ones we use once here.
+        # Query builders derived from them (.select(), .upsert(), ...) are
+        # created per call, so the handles are safe to share
+        self._tables = {
+            name: self.client.table(name)
+            for name in ("user_settings", "verifications", "verification_screenshots")
+        }
+        self._verification_bucket = self.client.storage.from_(self.bucket_name)
+
+        # Shared HTTP client with keep-alive: repeated Storage/REST calls
+        # reuse one TCP+TLS connection instead of handshaking every time,
+        # and the auth headers are built once here instead of per call
+        self._auth_headers = {
+            "apikey": self.service_key,
+            "Authorization": f"Bearer {self.service_key}"
+        }
+        self._http = httpx.Client(
+            base_url=self.url,
+            headers=self._auth_headers,
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+            timeout=httpx.Timeout(10.0)
+        )
+        # Async twin of the pooled client: the verification-path writes go
+        # through REST directly so blocking SDK socket I/O never stalls the
+        # event loop and concurrent requests actually overlap
+        # http2=True lets concurrent inserts, uploads and signing requests
+        # multiplex over one socket instead of contending for pool slots
+        self._ahttp = httpx.AsyncClient(
+            base_url=self.url,
+            headers=self._auth_headers,
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=50, max_connections=200),
+            timeout=httpx.Timeout(30.0)
+        )
+        atexit.register(self.close)
+
+        # The SDK calls that remain synchronous run through this executor so
+        # their blocking socket I/O never stalls the event loop; the
+        # semaphore caps in-flight SDK work so bursts can't exhaust the
+        # thread pool or the database connection budget
+        self._io_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="supabase-io")
+        self._db_sem = asyncio.Semaphore(20)
+
+        # Buffered screenshot rows, bulk-inserted in batches, on a short
+        # debounce timer, and at session completion (see
+        # _flush_screenshot_records)
+        self._screenshot_buffer: List[Dict[str, Any]] = []
+        self._screenshot_buffer_lock = asyncio.Lock()
+        self._screenshot_flush_task: Optional[asyncio.Task] = None
+
+        # Bucket existence memo: buckets don't disappear at runtime, so a
+        # positive probe is cached forever and a negative one for a TTL
+        self._bucket_ok = False
+        self._bucket_checked_at = 0.0
+
+        # storage_path -> (signed_url, expiry epoch); signed URLs live for
+        # an hour, so reuse them instead of re-signing per request
+        self._signed_url_cache: Dict[str, tuple] = {}
+
+        # session_id -> (current_step, progress) last written, so repeated
+        # identical progress reports skip the UPDATE round-trip
+        self._last_progress: Dict[str, tuple] = {}
+
+        # user_id -> (settings row, expiry); settings change rarely but are
+        # read on every verification, so a short TTL removes one query per
+        # request. save_user_settings invalidates the entry on write
+        self._settings_cache: Dict[str, tuple] = {}
+
+        # Ensure required storage bucket exists (returns readiness, so no
+        # second probe is needed for bucket_ready)
+        self.bucket_ready = self._ensure_storage_bucket()
         
-        # Ensure required storage bucket exists
-        self._ensure_storage_bucket()
-        self.bucket_ready = self.check_bucket_exists()
-        
-    def _ensure_storage_bucket(self):
-        """Ensure the storage bucket exists; try to create it if missing and validate afterwards."""
+    def _ensure_storage_bucket(self) -> bool:
+        """Ensure the storage bucket exists; try to create it if missing and
+        validate afterwards. Returns True when the bucket is ready."""
         try:
             # Quick existence check
             if self.check_bucket_exists():
                 print(f"✅ Storage bucket '{self.bucket_name}' is accessible and ready")
-                return
+                return True
 
             print(f"⚠️ Storage bucket '{self.bucket_name}' not found. Attempting to create...")
             try:
                 # Prefer direct HTTP call to avoid SDK silent failures
-                create_url = f"{self.url}/storage/v1/bucket"
-                headers = {
-                    "apikey": self.service_key,
-                    "Authorization": f"Bearer {self.service_key}",
-                    "Content-Type": "application/json"
-                }
                 payload = {
                     "name": self.bucket_name,
                     "public": False
                 }
-                resp = httpx.post(create_url, headers=headers, json=payload, timeout=15.0)
+                resp = self._http.post("/storage/v1/bucket", json=payload, timeout=15.0)
                 if resp.status_code not in (200, 201):
                     # Fallback to SDK if direct call didn't succeed
                     try:
@@ -65,45 +159,97 @@ class SupabaseService:
                         })
                     except Exception:
                         pass
-                # Validate creation
-                if self.check_bucket_exists():
+                # Validate creation (bypass the negative-probe memo)
+                if self.check_bucket_exists(force=True):
                     print(f"✅ Created storage bucket '{self.bucket_name}' successfully")
-                else:
-                    print(f"❌ Bucket '{self.bucket_name}' still not accessible after creation attempt")
+                    return True
+                print(f"❌ Bucket '{self.bucket_name}' still not accessible after creation attempt")
             except Exception as create_error:
                 print(f"ℹ️ Could not create bucket '{self.bucket_name}' (may already exist or insufficient permissions): {create_error}")
         except Exception as e:
             print(f"⚠️ Storage bucket verification failed: {e}")
             print(f"📝 Please ensure the '{self.bucket_name}' bucket exists in your Supabase Storage")
+        return False
+
+    _BUCKET_RECHECK_TTL = 300.0  # seconds before a negative probe is retried
+
+    def check_bucket_exists(self, force: bool = False) -> bool:
+        """Return True if the storage bucket exists and is accessible.
 
-    def check_bucket_exists(self) -> bool:
-        """Return True if the storage bucket exists and is accessible."""
+        The result is memoised: a successful probe is cached for the process
+        lifetime, a failed one for _BUCKET_RECHECK_TTL. Pass force=True to
+        bypass the cache (e.g. right after creating the bucket).
+        """
+        if self._bucket_ok:
+            return True
+        now = time.monotonic()
+        if not force and self._bucket_checked_at and (now - self._bucket_checked_at) < self._BUCKET_RECHECK_TTL:
+            return False
+        self._bucket_checked_at = now
         try:
             # Use Storage REST API to avoid SDK silent successes
-            url = f"{self.url}/storage/v1/bucket/{self.bucket_name}"
-            headers = {
-                "apikey": self.service_key,
-                "Authorization": f"Bearer {self.service_key}"
-            }
-            resp = httpx.get(url, headers=headers, timeout=10.0)
+            resp = self._http.get(f"/storage/v1/bucket/{self.bucket_name}")
             if resp.status_code == 200:
+                self._bucket_ok = True
                 return True
-            if resp.status_code == 404:
-                return False
-            # Unexpected response - treat as missing
+            # 404 or unexpected response - treat as missing
             return False
         except Exception:
             return False
     
+    async def warmup(self) -> None:
+        """Pre-warm the pooled async client with one throwaway request.
+
+        Pays the DNS + TCP + TLS handshake cost at startup instead of on
+        the first user action; keep-alive then holds the socket open. The
+        sync client is already warm from the bucket probe in __init__.
+        """
+        try:
+            response = await self._ahttp.get("/rest/v1/", headers={"Accept-Profile": "public"})
+            print(f"🔌 Supabase connection warm ({response.http_version})")
+        except Exception as e:
+            print(f"⚠️ Connection warmup failed (non-fatal): {e}")
+
+    def close(self) -> None:
+        """Close pooled HTTP connections."""
+        try:
+            self._http.close()
+        except Exception:
+            pass
+        try:
+            self._io_pool.shutdown(wait=False)
+        except Exception:
+            pass
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # No loop running (interpreter shutdown): dispose the async client
+            try:
+                asyncio.run(self._ahttp.aclose())
+            except Exception:
+                pass
+
     def get_client(self) -> Client:
         """Get the Supabase client instance"""
         return self.client
+
+    async def _run(self, fn, *args, **kwargs):
+        """Run a blocking SDK call in the shared executor.
+
+        Used by async methods that still go through supabase-py; awaiting
+        here yields the event loop while a worker thread does the I/O.
+        """
+        async with self._db_sem:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._io_pool, functools.partial(fn, *args, **kwargs)
+            )
     
     # User Management
     async def create_user(self, email: str, password: str) -> Dict[str, Any]:
         """Create a new user"""
         try:
-            response = self.client.auth.admin.create_user({
+            response = await self._run(self.client.auth.admin.create_user, {
                 "email": email,
                 "password": password,
                 "email_confirm": True
@@ -115,7 +261,7 @@ class SupabaseService:
     async def get_user(self, user_id: str) -> Optional[Dict[str, Any]]:
         """Get user by ID"""
         try:
-            response = self.client.auth.admin.get_user_by_id(user_id)
+            response = await self._run(self.client.auth.admin.get_user_by_id, user_id)
             return response.user if response else None
         except Exception as e:
             return None
@@ -125,22 +271,35 @@ class SupabaseService:
         """Save user settings to user_settings table"""
         try:
             # Upsert user settings
-            response = self.client.table("user_settings").upsert({
+            # updated_at is maintained by a DB trigger (see scripts/schema.sql)
+            query = self._tables["user_settings"].upsert({
                 "user_id": user_id,
                 "scra_username": settings.get("scraUsername"),
-                "scra_password": settings.get("scraPassword"),
-                "updated_at": datetime.now().isoformat()
-            }).execute()
-            
-            return len(response.data) > 0
+                "scra_password": settings.get("scraPassword")
+            })
+            response = await self._run(query.execute)
+
+            if len(response.data) > 0:
+                # Drop the cached copy so the next read sees the new values
+                self._settings_cache.pop(user_id, None)
+                return True
+            return False
         except Exception as e:
             return False
     
+    _SETTINGS_CACHE_TTL = 60.0  # seconds a cached settings row stays valid
+
     async def get_user_settings(self, user_id: str) -> Optional[Dict[str, Any]]:
-        """Get user settings"""
+        """Get user settings (cached briefly; writes invalidate the cache)"""
+        cached = self._settings_cache.get(user_id)
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
         try:
-            response = self.client.table("user_settings").select("*").eq("user_id", user_id).execute()
-            return response.data[0] if response.data else None
+            query = self._tables["user_settings"].select("*").eq("user_id", user_id)
+            response = await self._run(query.execute)
+            settings = response.data[0] if response.data else None
+            self._settings_cache[user_id] = (settings, time.monotonic() + self._SETTINGS_CACHE_TTL)
+            return settings
         except Exception as e:
             return None
     
@@ -148,36 +307,39 @@ class SupabaseService:
     async def save_verification(self, verification_data: Dict[str, Any]) -> bool:
         """Save verification record to database"""
         try:
-            # Prepare data for insertion
+            # Prepare data for insertion; created_at comes from the column
+            # default, timestamp stays client-side (no default in schema)
             insert_data = {
                 "session_id": verification_data["sessionId"],
                 "form_data": verification_data["formData"],
                 "result": verification_data["result"],
                 "status": verification_data.get("status", "completed"),
-                "timestamp": verification_data.get("timestamp", datetime.now().isoformat()),
-                "created_at": datetime.now().isoformat()
+                "timestamp": verification_data.get("timestamp", datetime.now().isoformat())
             }
             
             # Only add user_id if it exists (for authenticated users)
             if verification_data.get("userId"):
                 insert_data["user_id"] = verification_data["userId"]
-            
-            response = self.client.table("verifications").insert(insert_data).execute()
-            
-            return len(response.data) > 0
+
+            response = await self._ahttp.post(
+                "/rest/v1/verifications",
+                content=_json_content(insert_data),
+                headers={"Content-Type": "application/json", "Prefer": "return=minimal"}
+            )
+            return response.status_code == 201
         except Exception as e:
             return False
     
     async def get_user_verifications(self, user_id: str, limit: int = 50, offset: int = 0) -> List[Dict[str, Any]]:
         """Get verification history for a user"""
         try:
-            response = self.client.table("verifications")\
+            query = self._tables["verifications"]\
                 .select("*")\
                 .eq("user_id", user_id)\
                 .order("created_at", desc=True)\
                 .limit(limit)\
-                .offset(offset)\
-                .execute()
+                .offset(offset)
+            response = await self._run(query.execute)
             
             return response.data or []
         except Exception as e:
@@ -186,11 +348,11 @@ class SupabaseService:
     async def delete_verification(self, session_id: str, user_id: str) -> bool:
         """Delete a verification record"""
         try:
-            response = self.client.table("verifications")\
+            query = self._tables["verifications"]\
                 .delete()\
                 .eq("session_id", session_id)\
-                .eq("user_id", user_id)\
-                .execute()
+                .eq("user_id", user_id)
+            response = await self._run(query.execute)
             
             return len(response.data) > 0
         except Exception as e:
@@ -198,49 +360,76 @@ class SupabaseService:
     
     # Real-time Session Management
     async def create_verification_session(self, session_id: str, user_id: str, form_data: dict) -> bool:
-        """Create a new verification session for real-time tracking"""
+        """Create (or reset) a verification session for real-time tracking.
+
+        Upserts on session_id so a retried or restarted verification reuses
+        its row in one round-trip instead of failing the insert and needing
+        a follow-up update.
+        """
+        # A re-created session starts from scratch; forget any progress memo
+        self._last_progress.pop(session_id, None)
         try:
-            response = self.client.table("verification_sessions").insert({
-                "session_id": session_id,
-                "user_id": user_id,
-                "status": "in_progress",
-                "progress": 0,
-                "form_data": form_data,
-                "created_at": datetime.now().isoformat(),
-                "updated_at": datetime.now().isoformat()
-            }).execute()
-            
-            return len(response.data) > 0
+            response = await self._ahttp.post(
+                "/rest/v1/verification_sessions",
+                params={"on_conflict": "session_id"},
+                content=_json_content({
+                    "session_id": session_id,
+                    "user_id": user_id,
+                    "status": "in_progress",
+                    "progress": 0,
+                    "form_data": form_data
+                }),
+                headers={"Content-Type": "application/json",
+                         "Prefer": "resolution=merge-duplicates,return=minimal"}
+            )
+            return response.status_code in (200, 201, 204)
         except Exception as e:
             return False
     
     async def update_session_progress(self, session_id: str, current_step: str, progress: int) -> bool:
         """Update session progress and current step"""
+        # Callers frequently re-report the same step/progress; skip the
+        # no-op UPDATE when nothing changed since the last successful write
+        if self._last_progress.get(session_id) == (current_step, progress):
+            return True
         try:
-            response = self.client.table("verification_sessions").update({
-                "current_step": current_step,
-                "progress": progress,
-                "updated_at": datetime.now().isoformat()
-            }).eq("session_id", session_id).execute()
-            
-            return len(response.data) > 0
+            response = await self._ahttp.patch(
+                "/rest/v1/verification_sessions",
+                params={"session_id": f"eq.{session_id}"},
+                json={
+                    "current_step": current_step,
+                    "progress": progress
+                },
+                headers={"Prefer": "return=minimal"}
+            )
+            if response.status_code in (200, 204):
+                self._last_progress[session_id] = (current_step, progress)
+                return True
+            return False
         except Exception as e:
             return False
     
     async def complete_session(self, session_id: str, status: str, error_message: str = None) -> bool:
         """Mark session as completed or failed"""
+        # Land any buffered screenshot rows before the session is finalized
+        await self._flush_screenshot_records()
+        # The session is done; drop its progress memo
+        self._last_progress.pop(session_id, None)
         try:
             update_data = {
                 "status": status,
-                "progress": 100 if status == "completed" else 0,
-                "updated_at": datetime.now().isoformat()
+                "progress": 100 if status == "completed" else 0
             }
             if error_message:
                 update_data["error_message"] = error_message
-                
-            response = self.client.table("verification_sessions").update(update_data).eq("session_id", session_id).execute()
-            
-            return len(response.data) > 0
+
+            response = await self._ahttp.patch(
+                "/rest/v1/verification_sessions",
+                params={"session_id": f"eq.{session_id}"},
+                json=update_data,
+                headers={"Prefer": "return=minimal"}
+            )
+            return response.status_code in (200, 204)
         except Exception as e:
             return False
     
@@ -248,109 +437,182 @@ class SupabaseService:
         """Test that storage is reachable and the required bucket exists."""
         return self.check_bucket_exists()
 
-    def check_required_tables(self) -> Dict[str, bool]:
-        """Check presence of required tables by attempting a minimal select."""
-        required = [
-            "verifications",
-            "verification_screenshots",
-            "verification_sessions",
-            "user_settings",
-        ]
-        results: Dict[str, bool] = {}
-        for table in required:
-            try:
-                # select minimal column name; PostgREST tolerates '*' but we'll use '*'
-                self.client.table(table).select("*").limit(1).execute()
-                results[table] = True
-            except Exception:
-                results[table] = False
-        return results
+    async def check_required_tables(self) -> Dict[str, bool]:
+        """Check presence of required tables with concurrent minimal probes."""
+        # Probe each table's key column only; HEAD + limit=0 already sends
+        # a zero-byte body, and the single-column select keeps the server
+        # from planning every column for the probe
+        required = {
+            "verifications": "id",
+            "verification_screenshots": "id",
+            "verification_sessions": "id",
+            "user_settings": "user_id",
+        }
+        # The probes are independent, so issue all four at once: total
+        # latency is one round-trip instead of four
+        responses = await asyncio.gather(
+            *(self._ahttp.head(f"/rest/v1/{table}", params={"select": column, "limit": 0})
+              for table, column in required.items()),
+            return_exceptions=True
+        )
+        return {
+            table: not isinstance(resp, Exception) and resp.status_code == 200
+            for table, resp in zip(required, responses)
+        }
+
+    # Screenshots smaller than this aren't worth the CPU spent recompressing
+    _PNG_COMPRESS_THRESHOLD = 50 * 1024
+
+    async def _maybe_compress_png(self, screenshot_data: bytes) -> bytes:
+        """Recompress a PNG with pyoxipng when it's installed and the image
+        is large enough to matter. Runs in an executor so the CPU-bound
+        optimization never blocks the event loop; returns the original bytes
+        on any failure."""
+        if oxipng is None or len(screenshot_data) <= self._PNG_COMPRESS_THRESHOLD:
+            return screenshot_data
+        try:
+            loop = asyncio.get_running_loop()
+            compressed = await loop.run_in_executor(
+                None, lambda: oxipng.optimize_from_memory(screenshot_data, level=2)
+            )
+            if len(compressed) < len(screenshot_data):
+                return compressed
+        except Exception as e:
+            print(f"⚠️ PNG compression failed, uploading original: {e}")
+        return screenshot_data
 
     async def upload_screenshot_realtime(self, session_id: str, step: str, filename: str, description: str, screenshot_data: bytes, user_id: Optional[str] = None, max_retries: int = 3) -> bool:
         """Upload screenshot to storage and track in database with enhanced metadata and retry logic"""
-        import asyncio
-        
+        storage_path = f"sessions/{session_id}/screenshots/{filename}"
+
+        # The DB record only references the predetermined storage_path, so it
+        # doesn't depend on the upload response. Buffer it for a bulk insert
+        # (one PostgREST round-trip per batch instead of per screenshot)
+        screenshot_record = {
+            "session_id": session_id,
+            "step": step,
+            "filename": filename,
+            "description": description,
+            "storage_path": storage_path,
+            "uploaded_at": datetime.now().isoformat()
+        }
+
+        # Note: user_id and file_size columns may need to be added to the database schema
+        # For now, we'll store without them to maintain compatibility
+
+        async with self._screenshot_buffer_lock:
+            self._screenshot_buffer.append(screenshot_record)
+            flush_needed = len(self._screenshot_buffer) >= self._SCREENSHOT_BATCH_SIZE
+            if not flush_needed and (self._screenshot_flush_task is None
+                                     or self._screenshot_flush_task.done()):
+                # Debounce timer: the frontend's live feed subscribes to
+                # per-row INSERTs, so partial batches must still land
+                # promptly instead of waiting for a full batch
+                self._screenshot_flush_task = asyncio.create_task(self._flush_after_delay())
+        if flush_needed:
+            await self._flush_screenshot_records()
+
+        screenshot_data = await self._maybe_compress_png(screenshot_data)
+
         for attempt in range(max_retries):
+            # Add retry delay for subsequent attempts
+            if attempt > 0:
+                await asyncio.sleep(attempt * 0.5)  # Progressive backoff: 0.5s, 1s, 1.5s
+
             try:
-                # Upload to Supabase Storage
-                storage_path = f"sessions/{session_id}/screenshots/{filename}"
-                
-                # Add retry delay for subsequent attempts
-                if attempt > 0:
-                    await asyncio.sleep(attempt * 0.5)  # Progressive backoff: 0.5s, 1s, 1.5s
-                
-                response = self.client.storage.from_("verification-files").upload(
-                    storage_path, 
-                    screenshot_data, 
-                    {
-                        "content-type": "image/png",
-                        "upsert": "true"
+                response = await self._ahttp.post(
+                    f"/storage/v1/object/{self.bucket_name}/{storage_path}",
+                    content=screenshot_data,
+                    headers={
+                        "Content-Type": "image/png",
+                        "x-upsert": "true"
                     }
                 )
-                
-                if response:
-                    # Record in screenshots table (using existing schema)
-                    screenshot_record = {
-                        "session_id": session_id,
-                        "step": step,
-                        "filename": filename,
-                        "description": description,
-                        "storage_path": storage_path,
-                        "uploaded_at": datetime.now().isoformat()
-                    }
-                    
-                    # Note: user_id and file_size columns may need to be added to the database schema
-                    # For now, we'll store without them to maintain compatibility
-                    
-                    # Try database insert with retry
-                    try:
-                        self.client.table("verification_screenshots").insert(screenshot_record).execute()
-                        print(f"📤 Screenshot uploaded successfully: {filename} (attempt {attempt + 1})")
-                        return True
-                    except Exception as db_e:
-                        print(f"⚠️ Database insert failed for {filename} (attempt {attempt + 1}): {db_e}")
-                        if attempt == max_retries - 1:  # Last attempt
-                            # At least the file was uploaded to storage
-                            print(f"📤 Screenshot uploaded to storage but database record failed: {filename}")
-                            return True  # Consider partial success since file is in storage
-                        continue
-                else:
-                    print(f"⚠️ Storage upload failed for {filename} (attempt {attempt + 1})")
-                    
+                if response.status_code in (200, 201):
+                    print(f"📤 Screenshot uploaded successfully: {filename} (attempt {attempt + 1})")
+                    return True
+                print(f"⚠️ Storage upload failed for {filename} (attempt {attempt + 1}): {response.status_code}")
             except Exception as e:
                 print(f"❌ Screenshot upload error for {filename} (attempt {attempt + 1}/{max_retries}): {e}")
-                if attempt == max_retries - 1:  # Last attempt
-                    print(f"💥 Final upload failure for {filename} after {max_retries} attempts")
-                    return False
-                
+
+        print(f"💥 Final upload failure for {filename} after {max_retries} attempts")
         return False
 
-    async def upload_pdf_realtime(self, session_id: str, filename: str, pdf_data: bytes, user_id: str = None) -> bool:
-        """Upload PDF to storage and get public URL"""
+    _SCREENSHOT_BATCH_SIZE = 10
+    _SCREENSHOT_FLUSH_INTERVAL = 2.0  # seconds before a partial batch is flushed
+
+    async def _flush_after_delay(self) -> None:
+        """Flush whatever is buffered after a short debounce."""
+        await asyncio.sleep(self._SCREENSHOT_FLUSH_INTERVAL)
+        await self._flush_screenshot_records()
+
+    async def flush_screenshots(self) -> None:
+        """Flush any buffered screenshot rows immediately.
+
+        Called from the agent's cleanup path so trailing rows land even
+        for anonymous runs, which never go through complete_session.
+        """
+        await self._flush_screenshot_records()
+
+    async def _flush_screenshot_records(self) -> None:
+        """Bulk-insert buffered screenshot rows in one PostgREST call."""
+        async with self._screenshot_buffer_lock:
+            batch = self._screenshot_buffer
+            if not batch:
+                return
+            self._screenshot_buffer = []
+        try:
+            response = await self._ahttp.post(
+                "/rest/v1/verification_screenshots",
+                content=_json_content(batch),
+                headers={"Content-Type": "application/json", "Prefer": "return=minimal"}
+            )
+            if response.status_code != 201:
+                raise Exception(f"bulk insert returned {response.status_code}")
+            print(f"📤 Flushed {len(batch)} screenshot records")
+        except Exception as e:
+            # Re-queue so the next flush (or the final one at session
+            # completion) retries these rows
+            print(f"⚠️ Screenshot batch insert failed ({e}); will retry on next flush")
+            async with self._screenshot_buffer_lock:
+                self._screenshot_buffer = batch + self._screenshot_buffer
+
+    async def upload_pdf_realtime(self, session_id: str, filename: str,
+                                  pdf_data: Union[bytes, AsyncIterable[bytes]],
+                                  user_id: str = None) -> bool:
+        """Upload PDF to storage and get public URL.
+
+        pdf_data may be raw bytes or an async byte iterator; iterators are
+        streamed with chunked transfer encoding so large PDFs never have to
+        sit fully in memory on this side.
+        """
         try:
             # Upload to Supabase Storage - use consistent path structure
             if user_id:
                 storage_path = f"users/{user_id}/verifications/{session_id}/pdfs/{filename}"
             else:
                 storage_path = f"sessions/{session_id}/pdfs/{filename}"
-            
+
             print(f"📤 Uploading PDF to: {storage_path}")
-            print(f"📊 PDF size: {len(pdf_data)} bytes")
-            
-            response = self.client.storage.from_("verification-files").upload(
-                storage_path, 
-                pdf_data, 
-                {
-                    "content-type": "application/pdf",
-                    "upsert": "true"
+            if isinstance(pdf_data, bytes):
+                print(f"📊 PDF size: {len(pdf_data)} bytes")
+            else:
+                print("📊 PDF size: streaming (unknown up front)")
+
+            response = await self._ahttp.post(
+                f"/storage/v1/object/{self.bucket_name}/{storage_path}",
+                content=pdf_data,
+                headers={
+                    "Content-Type": "application/pdf",
+                    "x-upsert": "true"
                 }
             )
-            
-            if response:
+
+            if response.status_code in (200, 201):
                 print(f"✅ PDF uploaded successfully to {storage_path}")
                 return True
-            
-            print(f"⚠️ PDF upload returned empty response for {storage_path}")
+
+            print(f"⚠️ PDF upload failed with status {response.status_code} for {storage_path}")
             return False
         except Exception as e:
             print(f"❌ PDF upload error for {session_id}/{filename}: {str(e)}")
@@ -359,18 +621,97 @@ class SupabaseService:
             print(f"   Traceback: {traceback.format_exc()}")
             return False
 
+    _SIGNED_URL_CACHE_CAP = 1024
+    _SIGNED_URL_SLACK = 60  # stop serving a cached URL this close to expiry
+
+    def _get_cached_signed_url(self, storage_path: str, expires_in: int = 3600) -> Optional[str]:
+        """Create (or reuse) a signed URL for a storage path.
+
+        Signed URLs are valid for expires_in seconds; cached entries are
+        served until shortly before expiry, saving one round-trip per reuse.
+        """
+        cached = self._signed_url_cache.get(storage_path)
+        if cached and cached[1] > time.time() + self._SIGNED_URL_SLACK:
+            return cached[0]
+        signed_url = self._verification_bucket.create_signed_url(
+            storage_path,
+            expires_in=expires_in
+        )
+        url = signed_url.get("signedURL") if signed_url else None
+        if url:
+            self._signed_url_cache[storage_path] = (url, time.time() + expires_in)
+            if len(self._signed_url_cache) > self._SIGNED_URL_CACHE_CAP:
+                self._signed_url_cache.pop(next(iter(self._signed_url_cache)))
+        return url
+
+    async def _get_signed_urls_batch(self, storage_paths: List[str], expires_in: int = 3600) -> Dict[str, Optional[str]]:
+        """Sign many storage paths with one Storage request.
+
+        Cache hits are served directly; the remaining paths go through
+        POST /storage/v1/object/sign/{bucket}, which signs a whole list in
+        a single round-trip instead of one request per row. Returns a
+        storage_path -> signed URL mapping (None where signing failed).
+        """
+        now = time.time()
+        urls: Dict[str, Optional[str]] = {}
+        missing = []
+        for path in dict.fromkeys(storage_paths):
+            cached = self._signed_url_cache.get(path)
+            if cached and cached[1] > now + self._SIGNED_URL_SLACK:
+                urls[path] = cached[0]
+            else:
+                missing.append(path)
+        if missing:
+            try:
+                response = await self._ahttp.post(
+                    f"/storage/v1/object/sign/{self.bucket_name}",
+                    json={"expiresIn": expires_in, "paths": missing}
+                )
+                if response.status_code == 200:
+                    for entry in response.json():
+                        path = entry.get("path")
+                        signed = entry.get("signedURL")
+                        if path and signed:
+                            # The batch endpoint returns paths relative to
+                            # the Storage API root
+                            url = f"{self.url}/storage/v1{signed}"
+                            urls[path] = url
+                            self._signed_url_cache[path] = (url, now + expires_in)
+                    while len(self._signed_url_cache) > self._SIGNED_URL_CACHE_CAP:
+                        self._signed_url_cache.pop(next(iter(self._signed_url_cache)))
+                else:
+                    print(f"⚠️ Batch URL signing failed with status {response.status_code}")
+            except Exception as e:
+                print(f"⚠️ Batch URL signing error: {e}")
+        return {path: urls.get(path) for path in storage_paths}
+
+    async def get_pdf_signed_url(self, session_id: str, filename: str, user_id: str = None, expires_in: int = 3600) -> Optional[str]:
+        """Get a signed URL for a previously uploaded PDF"""
+        try:
+            # Mirror the path structure used by upload_pdf_realtime
+            if user_id:
+                storage_path = f"users/{user_id}/verifications/{session_id}/pdfs/{filename}"
+            else:
+                storage_path = f"sessions/{session_id}/pdfs/{filename}"
+
+            return await self._run(self._get_cached_signed_url, storage_path, expires_in=expires_in)
+        except Exception as e:
+            print(f"❌ Signed URL error for {session_id}/{filename}: {str(e)}")
+            return None
+
     # File Storage
     async def upload_file(self, bucket: str, file_path: str, file_data: bytes, content_type: str = "application/octet-stream") -> Optional[str]:
         """Upload file to Supabase Storage"""
         try:
-            response = self.client.storage.from_(bucket).upload(file_path, file_data, {
+            handle = self.client.storage.from_(bucket)
+            response = await self._run(handle.upload, file_path, file_data, {
                 "content-type": content_type,
                 "upsert": "true"
             })
             
             if response:
-                # Get public URL
-                public_url = self.client.storage.from_(bucket).get_public_url(file_path)
+                # Get public URL (local computation, no request)
+                public_url = handle.get_public_url(file_path)
                 return public_url
             return None
         except Exception as e:
@@ -386,7 +727,7 @@ class SupabaseService:
     async def delete_file(self, bucket: str, file_path: str) -> bool:
         """Delete file from storage"""
         try:
-            response = self.client.storage.from_(bucket).remove([file_path])
+            response = await self._run(self.client.storage.from_(bucket).remove, [file_path])
             return len(response) > 0
         except Exception as e:
             return False
@@ -395,25 +736,23 @@ class SupabaseService:
         """Get all screenshots for a session, ordered chronologically"""
         try:
             # Note: user_id filtering disabled for now due to schema constraints
-            query = self.client.table("verification_screenshots").select("*").eq("session_id", session_id)
+            query = self._tables["verification_screenshots"].select("*").eq("session_id", session_id).order("uploaded_at")
             
-            response = query.order("uploaded_at").execute()
+            response = await self._run(query.execute)
             
+            # One batch signing request covers every row (cached until near expiry)
+            signed_urls = await self._get_signed_urls_batch(
+                [row["storage_path"] for row in response.data]
+            )
             screenshots = []
             for row in response.data:
-                # Generate signed URL for frontend access
-                signed_url = self.client.storage.from_("verification-files").create_signed_url(
-                    row["storage_path"], 
-                    expires_in=3600  # 1 hour
-                )
-                
                 screenshots.append({
                     "id": row["id"],
                     "step": row["step"],
                     "filename": row["filename"],
                     "description": row["description"],
                     "uploaded_at": row["uploaded_at"],
-                    "url": signed_url.get("signedURL") if signed_url else None
+                    "url": signed_urls.get(row["storage_path"])
                 })
             
             return screenshots
@@ -425,20 +764,18 @@ class SupabaseService:
         """Get latest screenshots (user filtering disabled due to schema constraints)"""
         try:
             # Note: user_id filtering disabled for now due to schema constraints
-            response = self.client.table("verification_screenshots")\
+            query = self._tables["verification_screenshots"]\
                 .select("*")\
                 .order("uploaded_at", desc=True)\
-                .limit(limit)\
-                .execute()
+                .limit(limit)
+            response = await self._run(query.execute)
             
+            # One batch signing request covers every row (cached until near expiry)
+            signed_urls = await self._get_signed_urls_batch(
+                [row["storage_path"] for row in response.data]
+            )
             screenshots = []
             for row in response.data:
-                # Generate signed URL for frontend access
-                signed_url = self.client.storage.from_("verification-files").create_signed_url(
-                    row["storage_path"], 
-                    expires_in=3600  # 1 hour
-                )
-                
                 screenshots.append({
                     "id": row["id"],
                     "session_id": row["session_id"],
@@ -446,7 +783,7 @@ class SupabaseService:
                     "filename": row["filename"],
                     "description": row["description"],
                     "uploaded_at": row["uploaded_at"],
-                    "url": signed_url.get("signedURL") if signed_url else None
+                    "url": signed_urls.get(row["storage_path"])
                 })
             
             return screenshots
@@ -456,10 +793,15 @@ class SupabaseService:
 
 # Global instance
 supabase_service = None
+_service_lock = threading.Lock()
 
 def get_supabase_service() -> SupabaseService:
     """Get or create the global Supabase service instance"""
     global supabase_service
     if supabase_service is None:
-        supabase_service = SupabaseService()
+        # Double-checked: construction runs network probes, and concurrent
+        # first callers (FastAPI thread pool) must not each pay for them
+        with _service_lock:
+            if supabase_service is None:
+                supabase_service = SupabaseService()
     return supabase_service
\ No newline at end of file